@@ -2,14 +2,29 @@
 
 import gi
 gi.require_version("Gst", "1.0")
-from gi.repository import Gst, GLib
+gi.require_version("GstVideo", "1.0")
+from gi.repository import Gst, GstVideo, GLib
 
-from threading import Thread
-from time import sleep, time
-import sys, tty, termios, select
+from threading import Thread, Event, Condition
+from collections import deque
+from time import sleep, time, thread_time
+import os, sys, tty, termios, select, socket, json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    gi.require_foreign("cairo")
+    HAVE_CAIRO = True
+except Exception:
+    HAVE_CAIRO = False
 
 Gst.init(None)
 
+BENCH = "--bench" in sys.argv
+
 # ---------- Config ----------
 EO_DEV = "/dev/video0"
 IR_DEV = "/dev/video2"
@@ -29,14 +44,117 @@ EO_ZOOM_MAX = 21.0   # displays up to 20.0x (we show eo_zoom - 1)
 IR_ZOOM_MIN = 1.0
 IR_ZOOM_MAX = 8.0
 ZOOM_COOLDOWN = 0.1
+
+# Queue depth (buffers) per named queue in build_pipeline_desc()
+QUEUE_DEPTH = {
+    "q_eo_dec": 1, "q_eo_tee": 1, "q_eo": 1, "q_eo_small": 1,
+    "q_ir_dec": 1, "q_ir_tee": 1, "q_ir": 1, "q_ir_small": 1,
+    "q_present": 1,
+}
+# Max buffers in the pool of every producer that allocates (0 = as
+# negotiated), keyed by the queue it feeds or by the producer's own name.
+# Must cover queue depth plus whatever downstream holds (compositor keeps
+# the last frame of every pad), or the producer stalls waiting for buffers.
+POOL_MAX = {
+    "q_eo_dec": 4, "q_eo_tee": 6,
+    "q_ir_dec": 4, "q_ir_tee": 6,
+    "dec_worker": 6,   # jpegdec in each ParallelDecoder worker
+    "eocrop": 3, "ircrop": 3, "eocrop_small": 3, "ircrop_small": 3,
+    "eoscale_small": 3, "irscale_small": 3,   # PIP scalers
+    "comp": 3, "sysconv": 3, "postconv": 3,   # compositor and conversions after it
+}
+# Branches that may be shed when memory runs short (first shed first)
+OPTIONAL_BRANCHES = ["q_ir_detect", "q_eo_small", "q_ir_small"]
+MEM_SAMPLE_INTERVAL = 2   # seconds between memory samples, 0 = off
+MEM_REPORT_INTERVAL = 30  # seconds between printed memory reports, 0 = never
+MEM_CEILING_MB = 0        # RSS hard ceiling, 0 = off
+
+# IR hot-spot detector (needs numpy; markers need cairooverlay and pycairo)
+DETECT_ENABLE = True
+DETECT_FPS = 5
+DETECT_W = 320
+DETECT_H = 180
+DETECT_THRESH = 220        # GRAY8 level, white-hot
+DETECT_MIN_AREA = 4        # pixels at detect resolution
+DETECT_MAX_BLOBS = 16
+DETECT_EVENT_ADDR = ("127.0.0.1", 5600)   # UDP JSON events, None = off
+DETECT_REPORT_INTERVAL = 10               # seconds, 0 = off
+
+# Frame-rate budgets (fps) per pane and layout; 0 = full camera rate.
+# Hidden panes keep a trickle so their compositor pads stay negotiated.
+FPS_PIP = 15
+FPS_HIDDEN = 1
+PIP_FPS_STEPS = (10, 15, 0)   # 'f' cycles the PIP budget through these
+def _layout(eo, ir, eo_small, ir_small):
+    return {"q_eo": eo, "q_ir": ir, "q_eo_small": eo_small, "q_ir_small": ir_small}
+LAYOUT_FPS = {
+    MODE_WIDE:    _layout(0, FPS_HIDDEN, FPS_HIDDEN, FPS_HIDDEN),
+    MODE_EO_ZOOM: _layout(0, FPS_HIDDEN, FPS_HIDDEN, FPS_HIDDEN),
+    MODE_IR:      _layout(FPS_HIDDEN, 0, FPS_HIDDEN, FPS_HIDDEN),
+    MODE_SPLIT:   _layout(0, 0, FPS_HIDDEN, FPS_HIDDEN),
+    MODE_PIP_EO:  _layout(0, FPS_HIDDEN, FPS_HIDDEN, FPS_PIP),
+    MODE_PIP_IR:  _layout(FPS_HIDDEN, 0, FPS_PIP, FPS_HIDDEN),
+}
+# Which pane branches each camera feeds (camera rate = fastest of them)
+CAMERA_BRANCHES = {"eosrc": ("q_eo", "q_eo_small"), "irsrc": ("q_ir", "q_ir_small")}
+
+# QoS-driven quality ladder
+QOS_INTERVAL = 1          # seconds per stats window
+QOS_WARMUP = 5            # seconds after start before the ladder may move
+QOS_LATE_MS = 120         # mean frame age beyond the configured pipeline latency that counts as behind
+QOS_DROP_HIGH = 0.10      # display-path drop ratio that counts as overloaded
+QOS_DROP_LOW = 0.02       # ... and that counts as headroom
+QOS_DOWN_WINDOWS = 2      # consecutive bad windows before stepping down
+QOS_UP_WINDOWS = 10       # consecutive good windows before stepping back up
+QOS_LOW_SCALE = 0.75      # compositor output scale from the first rung on
+QOS_PIP_FPS = 5           # PIP budget from the second rung on
+
+# Presentation: "latency" shows each frame on arrival (sync=false);
+# "paced" runs the compositor at OUTPUT_FPS and presents on the clock
+PRESENT_MODE = "latency"
+OUTPUT_FPS = 30
+PACED_COMP_LATENCY_MS = 33   # how long the compositor waits for the later camera
+FRAME_HIST_EDGES_MS = (10, 20, 28, 31, 36, 40, 50, 67, 100)
+PACE_REPORT_INTERVAL = 30    # seconds, 0 = only on exit
+
+# CPU path: crop without copying pixels. The full panes switch from
+# videocrop to GstVideoMeta views (CropView) once the compositor is seen to
+# take the meta; the PIP crops let videocrop attach GstVideoCropMeta when the
+# element after it accepts it. False keeps every crop on videocrop copies.
+CPU_CROP_META = True
+
+# CPU MJPEG decode (no nvjpegdec): >1 spreads each camera's frames over
+# this many jpegdec workers and re-orders the output by capture order
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+DECODE_MAX_INFLIGHT = 2        # frames queued per worker before input is dropped
+DECODE_REORDER_WAIT_MS = 100   # give up on a frame still missing after this long
+DECODE_MAX_LATENESS_MS = 150   # drop a decoded frame older than this at hand-off
+DECODE_LATENCY_MS = 66         # decode + reorder time reported as pipeline latency
+DECODE_QUEUE_FRAMES = 2        # decoded frames the re-entry appsrc may hold
+DECODE_BENCH_FRAMES = 300      # frames per --bench-decode run
+DECODE_REPORT_INTERVAL = 10    # seconds, 0 = off
+
+BENCH_SETTLE = 3     # seconds before each --bench measurement
+BENCH_SECONDS = 10   # seconds per --bench measurement
 # ----------------------------
 
 def have(name):
     return Gst.ElementFactory.find(name) is not None
 
+def video_info(caps):
+    # GstVideo.VideoInfo.new_from_caps() is 1.20+; JetPack ships 1.14/1.16
+    info = GstVideo.VideoInfo()
+    if not info.from_caps(caps):
+        return None
+    return info
+
 HAVE_NVJPEGDEC = have("nvjpegdec")
 HAVE_NVVIDCONV = have("nvvidconv")
 HAVE_NVCOMPOSITOR = have("nvcompositor")
+HAVE_DETECT = DETECT_ENABLE and np is not None and have("appsink")
+HAVE_MARKERS = HAVE_DETECT and HAVE_CAIRO and have("cairooverlay")
+if HAVE_DETECT:
+    QUEUE_DEPTH["q_ir_detect"] = 1
 
 def choose_sink():
     for s in ("glimagesink", "xvimagesink", "autovideosink"):
@@ -44,76 +162,513 @@ def choose_sink():
             return s
     return "fakesink"
 
+def comp_caps(w, h, fps=0):
+    rate = f",framerate={fps}/1" if fps else ""
+    if HAVE_NVVIDCONV:
+        return f"video/x-raw(memory:NVMM),format=NV12,width={w},height={h}{rate}"
+    # cairooverlay only draws on BGRx; have the compositor produce it directly
+    fmt = "format=BGRx," if HAVE_MARKERS else ""
+    return f"video/x-raw,{fmt}width={w},height={h}{rate}"
+
+def queue(name):
+    return (f"queue name={name} max-size-buffers={QUEUE_DEPTH[name]} "
+            f"max-size-bytes=0 max-size-time=0 leaky=downstream")
+
+PARALLEL_DECODE = not HAVE_NVJPEGDEC and DECODE_WORKERS > 1
+
+def decode_stage(cam):
+    # Parallel decode splits the chain: JPEG frames leave through an appsink
+    # and decoded ones re-enter through an appsrc (see ParallelDecoder).
+    if HAVE_NVJPEGDEC:
+        return "nvjpegdec"
+    if not PARALLEL_DECODE:
+        return "jpegdec"
+    # The split hides v4l2src's capture latency from the latency query, so
+    # the appsrc reports capture + decode/reorder time itself. max-bytes only
+    # signals; attach_parallel_decoder() drops frames once it is reached.
+    frame = Gst.SECOND // 30
+    return (f"appsink name={cam}_jpeg sync=false max-buffers=2 drop=true emit-signals=true "
+            f"appsrc name={cam}_dec format=time is-live=true do-timestamp=false "
+            f"max-bytes={DECODE_QUEUE_FRAMES * 1280 * 720 * 2} "
+            f"min-latency={frame + DECODE_LATENCY_MS * Gst.MSECOND} "
+            f"max-latency={frame + DECODE_MAX_LATENESS_MS * Gst.MSECOND}")
+
+def crop_stage(name):
+    # Full-pane crop. CPU path: selectors route the pane either through
+    # videocrop (src_0/sink_0) or through CropView's appsink/appsrc pair
+    # (src_1/sink_1); see CropView. The appsrc reports the capture (and
+    # parallel decode) latency the split hides from the latency query.
+    if HAVE_NVVIDCONV:
+        return f"nvvidconv name={name}"
+    if not CPU_CROP_META:
+        return f"videocrop name={name}"
+    frame = Gst.SECOND // 30
+    lat = frame + (DECODE_LATENCY_MS * Gst.MSECOND if PARALLEL_DECODE else 0)
+    return (f"output-selector name={name}_route "
+            f"{name}_route.src_0 ! videocrop name={name} ! {name}_sel.sink_0 "
+            f"{name}_route.src_1 ! appsink name={name}_in sync=false max-buffers=1 drop=true "
+            f"emit-signals=true enable-last-sample=false "
+            f"appsrc name={name}_view format=time is-live=true do-timestamp=false "
+            f"max-bytes={2 * OUT_W * OUT_H * 2} min-latency={lat} max-latency={lat + frame} ! "
+            f"{name}_sel.sink_1 "
+            f"input-selector name={name}_sel sync-streams=false")
+
 # Build pipeline. We will use GPU path if nv* present, else CPU fallback.
 def build_pipeline_desc():
     sink = choose_sink()
-    jpegdec = "nvjpegdec" if HAVE_NVJPEGDEC else "jpegdec"
     vconv   = "nvvidconv" if HAVE_NVVIDCONV else "videoconvert"
 
     # Full-size branch converter/caps
     if HAVE_NVVIDCONV:
         to_full  = f"{vconv} ! video/x-raw(memory:NVMM),format=NV12,width={OUT_W},height={OUT_H}"
-        to_small = f"{vconv} ! video/x-raw(memory:NVMM),format=NV12,width=320,height=180"
-        comp_caps = f"video/x-raw(memory:NVMM),format=NV12,width={OUT_W},height={OUT_H}"
-        # textoverlay needs sysmem; convert after compositor
-        to_sysmem_after_comp = f"{vconv} ! video/x-raw,format=RGBA,width={OUT_W},height={OUT_H}"
+        to_small = f"{vconv} name={{}} ! video/x-raw(memory:NVMM),format=NV12,width=320,height=180"
+        # textoverlay needs sysmem; convert after compositor (size follows compcaps)
+        to_sysmem_after_comp = f"{vconv} name=sysconv ! video/x-raw,format={'BGRx' if HAVE_MARKERS else 'RGBA'} !"
+        to_detect = f"{vconv} ! video/x-raw,format=GRAY8,width={DETECT_W},height={DETECT_H}"
     else:
         to_full  = f"{vconv} ! videoscale ! video/x-raw,width={OUT_W},height={OUT_H}"
-        to_small = f"{vconv} ! videoscale ! video/x-raw,width=320,height=180"
-        comp_caps = f"video/x-raw,width={OUT_W},height={OUT_H}"
+        to_small = f"{vconv} ! videoscale name={{}} ! video/x-raw,width=320,height=180"
         to_sysmem_after_comp = ""
+        to_detect = f"videoscale ! video/x-raw,width={DETECT_W},height={DETECT_H} ! videoconvert ! video/x-raw,format=GRAY8"
 
     comp_name = "nvcompositor" if HAVE_NVCOMPOSITOR else "compositor"
 
+    # Decimated IR frames for the hot-spot detector; appsink drops rather than blocks
+    detect = ""
+    if HAVE_DETECT:
+        detect = (f"tir. ! {queue('q_ir_detect')} ! videorate drop-only=true max-rate={DETECT_FPS} ! "
+                  f"{to_detect} ! appsink name=irdetect max-buffers=1 drop=true sync=false")
+    # Marker overlay is linked in by set_markers_linked() only while the detector runs
+    markers = "cairooverlay name=markers" if HAVE_MARKERS else ""
+
     desc = f"""
-v4l2src device={EO_DEV} io-mode=2 do-timestamp=true !
-image/jpeg,width=1280,height=720,framerate=30/1 ! {jpegdec} !
-queue max-size-buffers=1 leaky=downstream !
-{to_full} ! queue max-size-buffers=1 leaky=downstream ! tee name=teo
+v4l2src name=eosrc device={EO_DEV} io-mode=2 do-timestamp=true !
+image/jpeg,width=1280,height=720,framerate=30/1 ! {decode_stage("eo")} !
+{queue("q_eo_dec")} !
+{to_full} ! {queue("q_eo_tee")} ! tee name=teo
 
 # EO full (crop on GPU if nvvidconv is present)
-teo. ! queue max-size-buffers=1 leaky=downstream ! {('nvvidconv name=eocrop' if HAVE_NVVIDCONV else 'videocrop name=eocrop')} ! comp.sink_0
+teo. ! {queue("q_eo")} ! {crop_stage("eocrop")} ! comp.sink_0
 
 # EO small PIP source
-teo. ! queue max-size-buffers=1 leaky=downstream ! {('nvvidconv name=eocrop_small' if HAVE_NVVIDCONV else 'videocrop name=eocrop_small')} ! {to_small} ! comp.sink_2
+teo. ! {queue("q_eo_small")} ! {('nvvidconv name=eocrop_small' if HAVE_NVVIDCONV else 'videocrop name=eocrop_small')} ! {to_small.format("eoscale_small")} ! comp.sink_2
 
-v4l2src device={IR_DEV} io-mode=2 do-timestamp=true !
-image/jpeg,width=1280,height=720,framerate=30/1 ! {jpegdec} !
-queue max-size-buffers=1 leaky=downstream !
-{to_full} ! queue max-size-buffers=1 leaky=downstream ! tee name=tir
+v4l2src name=irsrc device={IR_DEV} io-mode=2 do-timestamp=true !
+image/jpeg,width=1280,height=720,framerate=30/1 ! {decode_stage("ir")} !
+{queue("q_ir_dec")} !
+{to_full} ! {queue("q_ir_tee")} ! tee name=tir
 
 # IR full
-tir. ! queue max-size-buffers=1 leaky=downstream ! {('nvvidconv name=ircrop' if HAVE_NVVIDCONV else 'videocrop name=ircrop')} ! comp.sink_1
+tir. ! {queue("q_ir")} ! {crop_stage("ircrop")} ! comp.sink_1
 
 # IR small PIP source
-tir. ! queue max-size-buffers=1 leaky=downstream ! {('nvvidconv name=ircrop_small' if HAVE_NVVIDCONV else 'videocrop name=ircrop_small')} ! {to_small} ! comp.sink_3
+tir. ! {queue("q_ir_small")} ! {('nvvidconv name=ircrop_small' if HAVE_NVVIDCONV else 'videocrop name=ircrop_small')} ! {to_small.format("irscale_small")} ! comp.sink_3
+
+# IR hot-spot detector
+{detect}
+{markers}
 
 {comp_name} name=comp background=black !
-{comp_caps} !
-{to_sysmem_after_comp} !
-videoconvert !
+capsfilter name=compcaps caps="{comp_caps(OUT_W, OUT_H)}" !
+{to_sysmem_after_comp}
+videoconvert name=postconv !
 textoverlay name=overlay valignment=top halignment=center font-desc="Sans 24" !
+{queue("q_present")} !
+identity name=presented sync=false silent=true !
 {sink} name=outsink
 """
     return desc
 
+# ---------- Parallel MJPEG decode ----------
+class ParallelDecoder:
+    """Frame-parallel MJPEG decode. Every worker is its own
+    appsrc ! jpegdec ! appsink pipeline, so each decode runs on its own
+    streaming thread; finished frames are handed to on_frame in capture order."""
+    def __init__(self, name, workers, on_frame, now=None,
+                 reorder_wait_ms=DECODE_REORDER_WAIT_MS, max_inflight=DECODE_MAX_INFLIGHT,
+                 pool_probe=None):
+        self.name = name
+        self.on_frame = on_frame   # called with each Gst.Sample, in order
+        self.now = now             # current running time (ns) for lateness, or None
+        self.reorder_wait = reorder_wait_ms / 1000.0 if reorder_wait_ms else None
+        self.max_inflight = max_inflight
+        self.cond = Condition()
+        self.slots = {}            # seq -> [submit time, pts, sample, done]
+        self.seq = 0               # next sequence number to hand out
+        self.next_seq = 0          # next sequence number to emit
+        self.caps = None
+        self.decoded = 0
+        self.dropped = 0           # input frames refused (all workers busy)
+        self.late = 0              # frames skipped or dropped as too late
+        self.restarts = 0          # workers restarted after an error
+        self.since = time()
+        self.workers = []
+        for i in range(workers):
+            # appsrc input is bounded by max_inflight JPEG frames per worker
+            p = Gst.parse_launch(
+                "appsrc name=src format=time do-timestamp=false ! "
+                "jpegdec name=dec ! appsink name=sink sync=false emit-signals=true")
+            if pool_probe:
+                # pool_probe(pad, info, name) bounds the decoder's output pool
+                p.get_by_name("dec").get_static_pad("src").add_probe(
+                    Gst.PadProbeType.QUERY_DOWNSTREAM, pool_probe, "%s_dec_w%d" % (name, i))
+            p.get_by_name("sink").connect("new-sample", self.on_decoded, i)
+            bus = p.get_bus()
+            bus.add_signal_watch()
+            bus.connect("message::error", self.on_worker_error, i)
+            p.set_state(Gst.State.PLAYING)
+            self.workers.append((p, p.get_by_name("src"), deque()))
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def on_input(self, sink):
+        self.push(sink.emit("pull-sample"))
+        return Gst.FlowReturn.OK
+
+    def push(self, sample, wait=False):
+        buf = sample.get_buffer()
+        with self.cond:
+            while True:
+                w = min(range(len(self.workers)), key=lambda i: len(self.workers[i][2]))
+                if len(self.workers[w][2]) < self.max_inflight:
+                    break
+                if not wait:
+                    # every worker is backed up: this frame could only be late
+                    self.dropped += 1
+                    return
+                self.cond.wait()
+            seq = self.seq
+            self.seq += 1
+            self.slots[seq] = [time(), buf.pts, None, False]
+            self.workers[w][2].append((seq, buf.pts))
+            self.cond.notify_all()   # run() may be waiting for this slot's deadline
+            caps = sample.get_caps()
+            if self.caps is None or not caps.is_equal(self.caps):
+                self.caps = caps
+                for _, src, _ in self.workers:
+                    src.set_property("caps", caps)
+        self.workers[w][1].emit("push-buffer", buf)
+
+    def on_decoded(self, sink, w):
+        sample = sink.emit("pull-sample")
+        pts = sample.get_buffer().pts
+        with self.cond:
+            pending = self.workers[w][2]
+            while pending:
+                seq, p = pending.popleft()
+                slot = self.slots.get(seq)
+                if slot is not None:
+                    slot[3] = True
+                if p == pts:
+                    if slot is not None:
+                        slot[2] = sample
+                    break
+                # jpegdec dropped that frame; its slot is done with no sample
+            self.cond.notify_all()
+        return Gst.FlowReturn.OK
+
+    def on_worker_error(self, bus, msg, w):
+        # Main loop: the worker stopped (jpegdec gives up on a corrupt
+        # frame, for one); release the frames it held and restart it
+        err, dbg = msg.parse_error()
+        print("[decode] %s worker %d: %s, restarting" % (self.name, w, err.message))
+        p, _, pending = self.workers[w]
+        p.set_state(Gst.State.NULL)
+        with self.cond:
+            while pending:
+                seq, _ = pending.popleft()
+                slot = self.slots.get(seq)
+                if slot is not None:
+                    slot[3] = True
+            self.restarts += 1
+            self.cond.notify_all()
+        p.set_state(Gst.State.PLAYING)
+
+    def report(self):
+        with self.cond:
+            elapsed = time() - self.since
+            print("[decode] %s: %.1f fps out | dropped %d (workers busy) | late %d | restarts %d"
+                  % (self.name, self.decoded / elapsed, self.dropped, self.late, self.restarts))
+            self.decoded = self.dropped = self.late = self.restarts = 0
+            self.since = time()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    slot = self.slots.get(self.next_seq)
+                    if slot is not None and slot[3]:
+                        break
+                    timeout = None   # nothing pending: sleep until push() notifies
+                    if slot is not None and self.reorder_wait is not None:
+                        timeout = slot[0] + self.reorder_wait - time()
+                        if timeout <= 0:
+                            # stuck frame: skip it so later ones are not held back
+                            del self.slots[self.next_seq]
+                            self.next_seq += 1
+                            self.late += 1
+                            continue
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                slot = self.slots.pop(self.next_seq)
+                self.next_seq += 1
+            sample = slot[2]
+            if sample is None:
+                continue
+            if self.now is not None and slot[1] != Gst.CLOCK_TIME_NONE:
+                now = self.now()
+                if now is not None and now - slot[1] > DECODE_MAX_LATENESS_MS * Gst.MSECOND:
+                    self.late += 1
+                    continue
+            self.decoded += 1
+            self.on_frame(sample)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+        for p, _, _ in self.workers:
+            p.set_state(Gst.State.NULL)
+            p.get_bus().remove_signal_watch()
+
+def encode_test_frames(n):
+    p = Gst.parse_launch(
+        f"videotestsrc num-buffers={n} pattern=pinwheel ! "
+        f"video/x-raw,width=1280,height=720,framerate=30/1 ! jpegenc ! "
+        f"appsink name=out sync=false")
+    out = p.get_by_name("out")
+    p.set_state(Gst.State.PLAYING)
+    frames = []
+    while True:
+        sample = out.emit("try-pull-sample", 5 * Gst.SECOND)
+        if sample is None:
+            break
+        frames.append(sample)
+    p.set_state(Gst.State.NULL)
+    return frames
+
+def bench_decode():
+    # Throughput of the decode pool alone, 1..N workers, as fast as it goes
+    frames = encode_test_frames(DECODE_BENCH_FRAMES)
+    print("[bench] decoding %d 1280x720 JPEG frames" % len(frames))
+    base = None
+    for n in range(1, (os.cpu_count() or 1) + 1):
+        done = Event()
+        count = [0]
+        def _out(sample):
+            count[0] += 1
+            if count[0] == len(frames):
+                done.set()
+        dec = ParallelDecoder("bench", n, _out, reorder_wait_ms=0)
+        t0 = time()
+        for sample in frames:
+            dec.push(sample, wait=True)
+        done.wait(60)
+        fps = count[0] / (time() - t0)
+        dec.stop()
+        base = base or fps
+        print("[bench] decode %2d worker(s): %6.1f fps (%.2fx)" % (n, fps, fps / base))
+
+if "--bench-decode" in sys.argv:
+    bench_decode()
+    sys.exit(0)
+
 pipeline_desc = build_pipeline_desc()
 pipeline = Gst.parse_launch(pipeline_desc)
 
 # Elements
 comp = pipeline.get_by_name("comp")
+compcaps = pipeline.get_by_name("compcaps")
 overlay = pipeline.get_by_name("overlay")
 outsink = pipeline.get_by_name("outsink")
-try:
-    outsink.set_property("sync", False)
-except Exception:
-    pass
+
+# videocrop only copies pixels when downstream cannot take GstVideoCropMeta;
+# with the meta it passes the full frame through and the consumer reads just
+# the crop rectangle. The compositor is not guaranteed to take that meta, so
+# the full panes can switch to CropView, which only needs GstVideoMeta.
+CROP_META_API = GstVideo.video_crop_meta_api_get_type()
+VIDEO_META_API = GstVideo.video_meta_api_get_type()
+crop_meta_on = CPU_CROP_META
+crop_paths = {}   # crop name -> "meta"/"view" (zero-copy) or "copy"
+
+def note_crop_path(name, path):
+    if crop_paths.get(name) != path:
+        crop_paths[name] = path
+        print("[crop] %s: %s" % (name, "copy" if path == "copy" else "zero-copy (%s)" % path))
+
+class CropView:
+    """Zero-copy crop for a CPU full pane. Pushes each decoded frame again,
+    memory shared, with a GstVideoMeta whose plane offsets point at the crop
+    rectangle, so the compositor reads only that region while scaling. The
+    pane runs through videocrop until its allocation answer shows the
+    compositor takes GstVideoMeta, and goes back to videocrop whenever a
+    re-query after a caps change says otherwise or crop_meta_on is off.
+
+    Cost: a view keeps its parent frame's memory locked until the compositor
+    lets go of it, so the parent is discarded rather than returned to the
+    producer's pool and the producer allocates a new frame each time. Those
+    frames are outside POOL_MAX; mem_report() shows what the views hold."""
+    def __init__(self, name):
+        self.name = name
+        self.route = pipeline.get_by_name(name + "_route")
+        self.sel = pipeline.get_by_name(name + "_sel")
+        self.src = pipeline.get_by_name(name + "_view")
+        self.limit = self.src.get_property("max-bytes")
+        self.rect = (0, 0, 0, 0)   # left, right, top, bottom
+        self.in_caps = None
+        self.info = None
+        self.out_size = None
+        self.out_caps = None
+        self.checked = False       # allocation re-asked since the last caps change
+        self.frame_size = 0        # bytes of the parent frame each view holds
+        self.active = False
+        self.refused = False       # re-query said no; stay on videocrop until set_crop_meta()
+        pipeline.get_by_name(name + "_in").connect("new-sample", self.on_sample)
+        self.route_to(False)
+
+    def set_crop(self, left, right, top, bottom):
+        self.rect = (int(left), int(right), int(top), int(bottom))
+
+    def route_to(self, on):
+        # Main loop only. Inactive input-selector pads answer OK, so frames
+        # already on their way down the old side are just dropped.
+        self.active = on
+        i = 1 if on else 0
+        self.sel.set_property("active-pad", self.sel.get_static_pad("sink_%d" % i))
+        self.route.set_property("active-pad", self.route.get_static_pad("src_%d" % i))
+        if on:
+            self.checked = False
+            note_crop_path(self.name, "view")
+        else:
+            # videocrop re-queries allocation and its probe notes the path
+            pipeline.get_by_name(self.name).get_static_pad("src").mark_reconfigure()
+
+    def route_later(self, on):
+        def _do():
+            if self.active != on:
+                self.route_to(on)
+            return False
+        GLib.idle_add(_do)
+
+    def takes_video_meta(self):
+        # None until the appsrc has negotiated the current output caps
+        pad = self.src.get_static_pad("src")
+        caps = pad.get_current_caps()
+        if caps is None or not caps.is_equal(self.out_caps):
+            return None
+        query = Gst.Query.new_allocation(caps, False)
+        if not pad.peer_query(query):
+            return None
+        found, _ = query.find_allocation_meta(VIDEO_META_API)
+        return found
+
+    def view(self, buf, left, top, w, h):
+        finfo = self.info.finfo
+        meta = GstVideo.buffer_get_video_meta(buf)
+        if meta is not None:
+            offsets, strides = list(meta.offset), list(meta.stride)
+        else:
+            offsets, strides = list(self.info.offset), list(self.info.stride)
+        for p in range(finfo.n_planes):
+            # first component stored in plane p gives its subsampling / pixel size
+            c = [c for c in range(finfo.n_components) if finfo.plane[c] == p][0]
+            offsets[p] += ((top >> finfo.h_sub[c]) * strides[p]
+                           + (left >> finfo.w_sub[c]) * finfo.pixel_stride[c])
+        out = buf.copy_region(Gst.BufferCopyFlags.FLAGS | Gst.BufferCopyFlags.TIMESTAMPS |
+                              Gst.BufferCopyFlags.MEMORY, 0, buf.get_size())
+        GstVideo.buffer_add_video_meta_full(out, GstVideo.VideoFrameFlags.NONE, finfo.format,
+                                            w, h, finfo.n_planes, offsets, strides)
+        return out
+
+    def on_sample(self, sink):
+        sample = sink.emit("pull-sample")
+        buf = sample.get_buffer()
+        caps = sample.get_caps()
+        if self.in_caps is None or not caps.is_equal(self.in_caps):
+            self.in_caps = caps
+            self.info = video_info(caps)
+            self.out_size = None
+        if self.info is None or not self.active:
+            return Gst.FlowReturn.OK
+        left, right, top, bottom = self.rect
+        # even origin and size keep subsampled chroma planes aligned
+        left &= ~1
+        top &= ~1
+        w = (self.info.width - left - right) & ~1
+        h = (self.info.height - top - bottom) & ~1
+        if w <= 0 or h <= 0:
+            return Gst.FlowReturn.OK
+        if self.out_size != (w, h):
+            self.out_size = (w, h)
+            out_info = video_info(caps)
+            out_info.width = w
+            out_info.height = h
+            self.out_caps = out_info.to_caps()
+            self.src.set_property("caps", self.out_caps)
+            self.checked = False
+        if self.src.get_property("current-level-bytes") >= self.limit:
+            return Gst.FlowReturn.OK   # compositor is behind; keep the queue bounded
+        self.frame_size = buf.get_size()
+        self.src.emit("push-buffer", self.view(buf, left, top, w, h))
+        if not self.checked:
+            ok = self.takes_video_meta()
+            if ok is not None:
+                self.checked = True
+                if not ok:
+                    self.refused = True
+                    self.route_later(False)
+        return Gst.FlowReturn.OK
 
 # Crop elements (may be nvvidconv or videocrop depending on availability)
 eocrop = pipeline.get_by_name("eocrop")
 ircrop = pipeline.get_by_name("ircrop")
 eocrop_small = pipeline.get_by_name("eocrop_small")
 ircrop_small = pipeline.get_by_name("ircrop_small")
+crops = [eocrop, ircrop, eocrop_small, ircrop_small]
+# videocrop name -> CropView for the full panes that can switch to views
+crop_views = {name: CropView(name) for name in ("eocrop", "ircrop")
+              if pipeline.get_by_name(name + "_view") is not None}
+
+def crop_meta_probe(pad, info, name):
+    if not (info.type & Gst.PadProbeType.PULL):
+        return Gst.PadProbeReturn.OK
+    query = info.get_query()
+    if query is None or query.type != Gst.QueryType.ALLOCATION:
+        return Gst.PadProbeReturn.OK
+    found, idx = query.find_allocation_meta(CROP_META_API)
+    if found and not crop_meta_on:
+        query.remove_nth_allocation_meta(idx)
+        found = False
+    has_vmeta, _ = query.find_allocation_meta(VIDEO_META_API)
+    note_crop_path(name, "meta" if found and has_vmeta else "copy")
+    view = crop_views.get(name)
+    if view is not None and crop_meta_on and has_vmeta and not found and not view.refused:
+        view.route_later(True)
+    return Gst.PadProbeReturn.OK
+
+def is_videocrop(c):
+    return c is not None and c.get_factory().get_name() == "videocrop"
+
+def set_crop_meta(on):
+    # Renegotiate allocation so videocrop picks the path up on the next
+    # buffer (and switches a full pane to its CropView if it can)
+    global crop_meta_on
+    crop_meta_on = on
+    for v in crop_views.values():
+        v.refused = False
+        if v.active and not on:
+            v.route_to(False)
+    for c in crops:
+        if is_videocrop(c):
+            c.get_static_pad("src").mark_reconfigure()
+
+for c in crops:
+    if is_videocrop(c):
+        c.get_static_pad("src").add_probe(
+            Gst.PadProbeType.QUERY_DOWNSTREAM, crop_meta_probe, c.get_name())
 
 # compositor sink pads
 pad_cam_full  = comp.get_static_pad("sink_0")
@@ -122,8 +677,220 @@ pad_cam_small = comp.get_static_pad("sink_2")
 pad_ir_small  = comp.get_static_pad("sink_3")
 pads = [pad_cam_full, pad_ir_full, pad_cam_small, pad_ir_small]
 
+queues = {name: pipeline.get_by_name(name) for name in QUEUE_DEPTH}
+
+def running_time():
+    clock = pipeline.get_clock()
+    if clock is None:
+        return None
+    return clock.get_time() - pipeline.get_base_time()
+
+def attach_parallel_decoder(cam):
+    src = pipeline.get_by_name(cam + "_dec")
+    limit = src.get_property("max-bytes")
+    last_caps = [None]
+    def _out(sample):
+        if src.get_property("current-level-bytes") >= limit:
+            dec.late += 1   # downstream is not keeping up; keep the queue bounded
+            return
+        caps = sample.get_caps()
+        if last_caps[0] is None or not caps.is_equal(last_caps[0]):
+            last_caps[0] = caps
+            src.set_property("caps", caps)
+        src.emit("push-buffer", sample.get_buffer())
+    dec = ParallelDecoder(cam, DECODE_WORKERS, _out, running_time,
+                          pool_probe=cap_pool_probe if POOL_MAX["dec_worker"] > 0 else None)
+    pipeline.get_by_name(cam + "_jpeg").connect("new-sample", dec.on_input)
+    return dec
+
+# ---------- Buffer pools / memory accounting ----------
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+pool_info = {}           # pool name -> (buffer size, min, max) answered upstream
+pool_pads = {}           # pool name -> pad its buffers leave the producer on
+pool_seen = {}           # pool name -> distinct buffers seen while counting
+pool_count_probes = {}   # pool name -> counting probe id
+branch_drop_probes = {}  # queue name -> probe id while the branch is stopped
+branch_off = set()       # switched off by the user or the quality ladder
+branch_shed = set()      # shed by the memory ceiling; only a restart brings these back
+mem_shed = False
+last_mem_report = 0.0
+
+def mb(n):
+    return n / (1024.0 * 1024.0)
+
+def frame_bytes(caps):
+    # Size of one raw frame (NVMM surfaces included), 0 if unknown
+    if caps is None or not caps.is_fixed():
+        return 0
+    if not caps.get_structure(0).get_name().startswith("video/x-raw"):
+        return 0
+    try:
+        info = video_info(caps)
+    except Exception:
+        return 0
+    return info.size if info else 0
+
+def cap_pool_probe(pad, info, name):
+    # Runs on the answer of the ALLOCATION query: bound the pool the
+    # producer upstream of this queue (or the producer itself) allocates from.
+    if not (info.type & Gst.PadProbeType.PULL):
+        return Gst.PadProbeReturn.OK
+    query = info.get_query()
+    if query is None or query.type != Gst.QueryType.ALLOCATION:
+        return Gst.PadProbeReturn.OK
+    cap = POOL_MAX["dec_worker" if "_dec_w" in name else name]
+    caps, _ = query.parse_allocation()
+    size = frame_bytes(caps)
+    if query.get_n_allocation_pools() == 0 and size:
+        # nothing proposed: producer makes its own pool with these limits
+        query.add_allocation_pool(None, size, 0, cap)
+    for i in range(query.get_n_allocation_pools()):
+        pool, psize, pmin, pmax = query.parse_nth_allocation_pool(i)
+        if pmax == 0 or pmax > max(pmin, cap):
+            pmax = max(pmin, cap)
+        query.set_nth_allocation_pool(i, pool, psize, pmin, pmax)
+        if i == 0:
+            pool_info[name] = (psize or size, pmin, pmax)
+            pool_pads[name] = pad
+    return Gst.PadProbeReturn.OK
+
+for name, cap in POOL_MAX.items():
+    elem = queues.get(name)
+    if elem is None:
+        elem = pipeline.get_by_name(name)
+    if cap > 0 and elem is not None:
+        elem.get_static_pad("src").add_probe(
+            Gst.PadProbeType.QUERY_DOWNSTREAM, cap_pool_probe, name)
+
+def count_probe(pad, info, name):
+    # hash of a Gst.Buffer is its pointer; pooled buffers keep theirs
+    pool_seen[name].add(hash(info.get_buffer()))
+    return Gst.PadProbeReturn.OK
+
+def start_pool_count():
+    # Only runs for the sample interval before a report, not on every frame
+    if pool_count_probes:
+        return
+    for name, pad in list(pool_pads.items()):
+        pool_seen[name] = set()
+        pool_count_probes[name] = pad.add_probe(Gst.PadProbeType.BUFFER, count_probe, name)
+
+def stop_pool_count():
+    for name, pid in pool_count_probes.items():
+        pool_pads[name].remove_probe(pid)
+    pool_count_probes.clear()
+
+decoders = []
+if PARALLEL_DECODE:
+    decoders = [attach_parallel_decoder(cam) for cam in ("eo", "ir")]
+    print("MJPEG decode: %d jpegdec workers per camera" % DECODE_WORKERS)
+
+def decode_tick():
+    for dec in decoders:
+        dec.report()
+    return True
+
+if decoders and DECODE_REPORT_INTERVAL > 0:
+    GLib.timeout_add_seconds(DECODE_REPORT_INTERVAL, decode_tick)
+
+def drop_probe(pad, info):
+    return Gst.PadProbeReturn.DROP
+
+def branch_on(name):
+    return name not in branch_off and name not in branch_shed
+
+def update_branch(name):
+    # A branch runs only while it is both enabled and not shed
+    q = queues.get(name)
+    if q is None:
+        return
+    pad = q.get_static_pad("src")
+    if branch_on(name) and name in branch_drop_probes:
+        pad.remove_probe(branch_drop_probes.pop(name))
+    elif not branch_on(name) and name not in branch_drop_probes:
+        branch_drop_probes[name] = pad.add_probe(Gst.PadProbeType.BUFFER, drop_probe)
+
+def set_branch_enabled(name, on):
+    if on:
+        branch_off.discard(name)
+    else:
+        branch_off.add(name)
+    update_branch(name)
+
+def shed_branch(name):
+    branch_shed.add(name)
+    update_branch(name)
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except Exception:
+        return 0
+
+def mem_report(rss):
+    parts = ["rss %.1fMB" % mb(rss)]
+    for name, q in queues.items():
+        if q is None:
+            continue
+        n = q.get_property("current-level-buffers")
+        fb = frame_bytes(q.get_static_pad("src").get_current_caps())
+        parts.append("%s %d buf %.1fMB" % (name, n, mb(n * fb)))
+    for name, (size, pmin, pmax) in pool_info.items():
+        if name in pool_count_probes:
+            live = len(pool_seen[name])
+            parts.append("pool %s %d live (max %d) x %.1fMB = %.1fMB"
+                         % (name, live, pmax, mb(size), mb(size * live)))
+        else:
+            parts.append("pool %s max %d x %.1fMB" % (name, pmax, mb(size)))
+    for name, v in crop_views.items():
+        if v.active:
+            # views queued in the appsrc plus the one the compositor holds
+            held = v.src.get_property("current-level-bytes") + v.frame_size
+            parts.append("view %s %.1fMB outside pools" % (name, mb(held)))
+    shed = [n for n in OPTIONAL_BRANCHES if n in branch_shed]
+    if shed:
+        parts.append("shed " + ",".join(shed))
+    print("[mem] " + " | ".join(parts))
+
+def enforce_mem_ceiling(rss):
+    # Queues already hold one buffer each, so the only lever is dropping the
+    # optional branches (and the pools behind them)
+    global mem_shed
+    if MEM_CEILING_MB <= 0 or mb(rss) < MEM_CEILING_MB:
+        return
+    if not mem_shed:
+        mem_shed = True
+        for name in OPTIONAL_BRANCHES:
+            shed_branch(name)
+        print("[mem] rss %.1fMB over %dMB ceiling: disabled %s"
+              % (mb(rss), MEM_CEILING_MB, ", ".join(OPTIONAL_BRANCHES)))
+        set_mode(current_mode)   # runs on the main loop; hides shed insets
+
+def mem_tick():
+    global last_mem_report
+    rss = rss_bytes()
+    enforce_mem_ceiling(rss)
+    now = time()
+    if MEM_REPORT_INTERVAL > 0:
+        if now - last_mem_report >= MEM_REPORT_INTERVAL:
+            last_mem_report = now
+            mem_report(rss)
+            stop_pool_count()
+        elif now - last_mem_report >= MEM_REPORT_INTERVAL - MEM_SAMPLE_INTERVAL:
+            start_pool_count()
+    return True
+
+if MEM_SAMPLE_INTERVAL > 0:
+    GLib.timeout_add_seconds(MEM_SAMPLE_INTERVAL, mem_tick)
+
 # Zoom state
 eo_zoom = 2.0
+# Where IR is on screen: [((crop x, y, w, h), (pane x, y, w, h))] in OUT_W x OUT_H
+ir_views = []
+out_scale = 1.0   # compositor output size relative to OUT_W x OUT_H
+present_mode = PRESENT_MODE
 current_mode = MODE_WIDE
 last_zoom_time = 0.0
 
@@ -159,12 +926,14 @@ def eo_step_down_clean(val):
         return new_val
 
 def reset_pads_and_crops():
+    global ir_views
+    ir_views = []
     for p in pads:
         p.set_property("width", -1)
         p.set_property("height", -1)
         p.set_property("alpha", 0.0)
     # reset crop on both GPU and CPU crop elements
-    for c in (eocrop, ircrop, eocrop_small, ircrop_small):
+    for c in crops:
         if c is None: continue
         if HAVE_NVVIDCONV and c.get_factory().get_name() == "nvvidconv":
             # nvvidconv uses src-crop "x,y,w,h"; empty string disables crop
@@ -173,7 +942,9 @@ def reset_pads_and_crops():
             except Exception:
                 pass
         else:
-            # videocrop
+            # videocrop (and the view that may stand in for it)
+            if c.get_name() in crop_views:
+                crop_views[c.get_name()].set_crop(0, 0, 0, 0)
             for prop in ("left","right","top","bottom"):
                 try:
                     c.set_property(prop, 0)
@@ -192,6 +963,8 @@ def set_nv_crop(elem, left, top, width, height):
 
 def set_cpu_crop(elem, left, right, top, bottom):
     if elem is None: return
+    if elem.get_name() in crop_views:
+        crop_views[elem.get_name()].set_crop(left, right, top, bottom)
     try: elem.set_property("left", left)
     except Exception: pass
     try: elem.set_property("right", right)
@@ -201,6 +974,9 @@ def set_cpu_crop(elem, left, right, top, bottom):
     try: elem.set_property("bottom", bottom)
     except Exception: pass
 
+def note_ir_view(left, top, width, height, px, py, pw, ph):
+    ir_views.append(((left, top, width, height), (px, py, pw, ph)))
+
 def update_overlay_text():
     if current_mode == MODE_WIDE:
         overlay.set_property("text", "WIDE")
@@ -255,6 +1031,7 @@ def apply_zoom(mode):
     if mode == MODE_IR:
         if not set_nv_crop(ircrop, ir_left, ir_top, ir_w, ir_h):
             set_cpu_crop(ircrop, ir_left, ir_right, ir_top, ir_bottom)
+        note_ir_view(ir_left, ir_top, ir_w, ir_h, 0, 0, OUT_W, OUT_H)
         pad_ir_full.set_property("alpha", 1.0)
         pad_ir_full.set_property("width", OUT_W)
         pad_ir_full.set_property("height", OUT_H)
@@ -281,6 +1058,7 @@ def apply_zoom(mode):
         extra_ir_each = extra_ir // 2
         if not set_nv_crop(ircrop, ir_left + extra_ir_each, ir_top, ir_w - 2*extra_ir_each, ir_h):
             set_cpu_crop(ircrop, ir_left + extra_ir_each, ir_right + extra_ir_each, ir_top, ir_bottom)
+        note_ir_view(ir_left + extra_ir_each, ir_top, ir_w - 2*extra_ir_each, ir_h, 640, 0, 640, 720)
         pad_ir_full.set_property("alpha", 1.0)
         pad_ir_full.set_property("width", 640)
         pad_ir_full.set_property("height", 720)
@@ -299,7 +1077,9 @@ def apply_zoom(mode):
 
         if not set_nv_crop(ircrop_small, ir_left, ir_top, ir_w, ir_h):
             set_cpu_crop(ircrop_small, ir_left, ir_right, ir_top, ir_bottom)
-        pad_ir_small.set_property("alpha", 1.0)
+        if branch_on("q_ir_small"):
+            note_ir_view(ir_left, ir_top, ir_w, ir_h, OUT_W - 320, OUT_H - 180, 320, 180)
+        pad_ir_small.set_property("alpha", 1.0 if branch_on("q_ir_small") else 0.0)
         pad_ir_small.set_property("width", 320)
         pad_ir_small.set_property("height", 180)
         pad_ir_small.set_property("xpos", OUT_W - 320)
@@ -310,6 +1090,7 @@ def apply_zoom(mode):
     if mode == MODE_PIP_IR:
         if not set_nv_crop(ircrop, ir_left, ir_top, ir_w, ir_h):
             set_cpu_crop(ircrop, ir_left, ir_right, ir_top, ir_bottom)
+        note_ir_view(ir_left, ir_top, ir_w, ir_h, 0, 0, OUT_W, OUT_H)
         pad_ir_full.set_property("alpha", 1.0)
         pad_ir_full.set_property("width", OUT_W)
         pad_ir_full.set_property("height", OUT_H)
@@ -318,7 +1099,7 @@ def apply_zoom(mode):
 
         if not set_nv_crop(eocrop_small, eo_left, eo_top, eo_w, eo_h):
             set_cpu_crop(eocrop_small, eo_left, eo_right, eo_top, eo_bottom)
-        pad_cam_small.set_property("alpha", 1.0)
+        pad_cam_small.set_property("alpha", 1.0 if branch_on("q_eo_small") else 0.0)
         pad_cam_small.set_property("width", 320)
         pad_cam_small.set_property("height", 180)
         pad_cam_small.set_property("xpos", OUT_W - 320)
@@ -326,22 +1107,645 @@ def apply_zoom(mode):
         pad_cam_small.set_property("zorder", 10)
         return
 
+def scale_pads():
+    # apply_zoom() lays panes out at OUT_W x OUT_H; shrink to the live output
+    if out_scale == 1.0:
+        return
+    for p in pads:
+        if p.get_property("alpha") == 0.0:
+            continue
+        for prop in ("xpos", "ypos", "width", "height"):
+            v = p.get_property(prop)
+            if v > 0:
+                p.set_property(prop, int(v * out_scale))
+
+def update_compcaps():
+    w = int(OUT_W * out_scale) & ~1
+    h = int(OUT_H * out_scale) & ~1
+    fps = OUTPUT_FPS if present_mode == "paced" else 0
+    compcaps.set_property("caps", Gst.Caps.from_string(comp_caps(w, h, fps)))
+
+def set_out_scale(scale):
+    global out_scale
+    if scale == out_scale:
+        return
+    out_scale = scale
+    update_compcaps()
+    apply_zoom(current_mode)
+    scale_pads()
+
 def set_mode(mode):
     for p in pads:
         p.set_property("alpha", 0.0)
     global current_mode
     current_mode = mode
     apply_zoom(mode)
+    scale_pads()
+    apply_fps_budgets(mode)
     update_overlay_text()
 
 def schedule_apply():
     def _do():
         apply_zoom(current_mode)
+        scale_pads()
         update_overlay_text()
         return False
     GLib.idle_add(_do)
 
-# Keyboard handling (SPACE / UP/i / DOWN/k)
+# ---------- Frame-rate budgets ----------
+class RateGate:
+    """Pad probe passing at most `fps` buffers per second of PTS (0 = all)."""
+    def __init__(self):
+        self.fps = 0
+        self.next_pts = None
+        self.dropped = 0
+
+    def set_fps(self, fps):
+        if fps != self.fps:
+            self.fps = fps
+            self.next_pts = None
+
+    def probe(self, pad, info):
+        fps = self.fps
+        pts = info.get_buffer().pts
+        if fps <= 0 or pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        period = Gst.SECOND // fps
+        # a quarter period of slack absorbs camera timestamp jitter
+        if self.next_pts is not None and pts + period // 4 < self.next_pts:
+            self.dropped += 1
+            return Gst.PadProbeReturn.DROP
+        if self.next_pts is None or pts - self.next_pts > period:
+            self.next_pts = pts + period
+        else:
+            self.next_pts += period
+        return Gst.PadProbeReturn.OK
+
+fps_budgets_on = True
+branch_gates = {}
+camera_gates = {}
+for name in ("q_eo", "q_ir", "q_eo_small", "q_ir_small"):
+    branch_gates[name] = RateGate()
+    queues[name].get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, branch_gates[name].probe)
+# Camera gates sit on the v4l2src pad, so dropped frames are never decoded
+for name in CAMERA_BRANCHES:
+    camera_gates[name] = RateGate()
+    pipeline.get_by_name(name).get_static_pad("src").add_probe(
+        Gst.PadProbeType.BUFFER, camera_gates[name].probe)
+
+def apply_fps_budgets(mode):
+    budgets = LAYOUT_FPS[mode]
+    for name, gate in branch_gates.items():
+        gate.set_fps(budgets[name] if fps_budgets_on else 0)
+    for cam, names in CAMERA_BRANCHES.items():
+        rates = [branch_gates[n].fps for n in names]
+        if cam == "irsrc" and detector and detector.enabled and branch_on("q_ir_detect"):
+            rates.append(DETECT_FPS)
+        camera_gates[cam].set_fps(0 if 0 in rates else max(rates))
+
+def set_pane_fps(mode, name, fps):
+    LAYOUT_FPS[mode][name] = fps
+    if mode == current_mode:
+        apply_fps_budgets(mode)
+
+def set_pip_fps(fps):
+    set_pane_fps(MODE_PIP_EO, "q_ir_small", fps)
+    set_pane_fps(MODE_PIP_IR, "q_eo_small", fps)
+    print("PIP budget: %s" % ("%d fps" % fps if fps else "full rate"))
+
+def cycle_pip_fps():
+    cur = LAYOUT_FPS[MODE_PIP_EO]["q_ir_small"]
+    steps = list(PIP_FPS_STEPS)
+    nxt = steps[(steps.index(cur) + 1) % len(steps)] if cur in steps else steps[0]
+    set_pip_fps(nxt)
+
+# ---------- IR hot-spot detector ----------
+def find_blobs(gray):
+    # Threshold, then 4-connected labelling on row runs, all in array ops:
+    # find the runs, the overlaps between runs on adjacent rows, and join
+    # them with an array union-find (no Python loop over runs or overlaps).
+    mask = gray >= DETECT_THRESH
+    if not mask.any():
+        return []
+    h, w = mask.shape
+    edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    n = len(rows)
+
+    # run i touches run j on the next row iff start_j < end_i and end_j > start_i;
+    # within a row both are sorted, so the matches form one index range
+    span = w + 2
+    lo = np.searchsorted(rows * span + ends, (rows + 1) * span + starts, side="right")
+    hi = np.searchsorted(rows * span + starts, (rows + 1) * span + ends, side="left")
+    count = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(n), count)
+    b = np.repeat(lo, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+
+    # Hook the larger root of every joining overlap onto the smaller one,
+    # then compress each run to its root; done when no overlap joins two roots
+    parent = np.arange(n)
+    while True:
+        ra, rb = parent[a], parent[b]
+        join = ra != rb
+        if not join.any():
+            break
+        ra, rb = ra[join], rb[join]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            up = parent[parent]
+            if np.array_equal(up, parent):
+                break
+            parent = up
+    _, inv = np.unique(parent, return_inverse=True)
+
+    length = ends - starts
+    area = np.bincount(inv, weights=length)
+    cx = np.bincount(inv, weights=length * (starts + ends - 1) / 2.0) / area
+    cy = np.bincount(inv, weights=length * rows) / area
+    run_peak = np.maximum.reduceat(gray[mask], np.cumsum(length) - length)
+    peak = np.zeros(len(area), dtype=np.uint8)
+    np.maximum.at(peak, inv, run_peak)
+
+    keep = np.nonzero(area >= DETECT_MIN_AREA)[0]
+    keep = keep[np.argsort(area[keep])[::-1][:DETECT_MAX_BLOBS]]
+    return [(float(cx[i]), float(cy[i]), int(area[i]), int(peak[i])) for i in keep]
+
+class HotSpotDetector:
+    def __init__(self, sink):
+        self.sink = sink
+        self.enabled = True
+        self.running = False
+        self.thread = None
+        # [(x, y, radius)] in OUT_W x OUT_H IR source pixels, read by draw_markers
+        self.markers = []
+        self.sock = None
+        if DETECT_EVENT_ADDR:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.n = 0
+        self.proc = 0.0
+        self.cpu = 0.0
+        self.age = 0.0
+        self.nblobs = 0
+        self.since = time()
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        if self.sock:
+            self.sock.close()
+
+    def set_enabled(self, on):
+        self.enabled = on
+        set_branch_enabled("q_ir_detect", on)
+        if not on:
+            self.markers = []
+        set_markers_linked(on)
+        apply_fps_budgets(current_mode)
+        print("Detector %s" % ("on" if on else "off"))
+
+    def frame_from_sample(self, sample):
+        buf = sample.get_buffer()
+        info = video_info(sample.get_caps())
+        if info is None:
+            return None
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            rows = np.frombuffer(mapinfo.data, dtype=np.uint8)
+            rows = rows[:info.stride[0] * info.height].reshape(info.height, info.stride[0])
+            return rows[:, :info.width].copy()
+        finally:
+            buf.unmap(mapinfo)
+
+    def run(self):
+        idle = 0
+        while self.running:
+            sample = self.sink.try_pull_sample(Gst.SECOND // 4)
+            if sample is None:
+                idle += 1
+                if idle >= 4:
+                    self.markers = []
+                continue
+            idle = 0
+            if not self.enabled:
+                continue
+            t0 = time()
+            c0 = thread_time()
+            gray = self.frame_from_sample(sample)
+            if gray is None:
+                continue
+            blobs = find_blobs(gray)
+            sx = float(OUT_W) / gray.shape[1]
+            sy = float(OUT_H) / gray.shape[0]
+            self.markers = [(x * sx, y * sy, max(1.0, (a / 3.14159) ** 0.5) * sx)
+                            for x, y, a, _ in blobs]
+            pts = sample.get_buffer().pts
+            self.publish(pts, blobs, sx, sy)
+            self.account(t0, c0, pts, len(blobs))
+
+    def publish(self, pts, blobs, sx, sy):
+        if self.sock is None or not blobs:
+            return
+        event = {
+            "t": time(),
+            "pts": pts if pts != Gst.CLOCK_TIME_NONE else None,
+            "frame": [OUT_W, OUT_H],
+            "blobs": [{"x": round(x * sx, 1), "y": round(y * sy, 1), "area": a, "peak": p}
+                      for x, y, a, p in blobs],
+        }
+        try:
+            self.sock.sendto(json.dumps(event).encode("ascii"), DETECT_EVENT_ADDR)
+        except OSError:
+            pass
+
+    def account(self, t0, c0, pts, nblobs):
+        self.n += 1
+        self.proc += time() - t0
+        self.cpu += thread_time() - c0
+        self.nblobs = nblobs
+        clock = pipeline.get_clock()
+        if clock is not None and pts != Gst.CLOCK_TIME_NONE:
+            self.age += (clock.get_time() - pipeline.get_base_time() - pts) / 1e9
+        elapsed = time() - self.since
+        if DETECT_REPORT_INTERVAL > 0 and elapsed >= DETECT_REPORT_INTERVAL:
+            print("[detect] %.1f fps | proc %.1f ms | cpu %.1f ms (%.1f%% of a core) | age %.0f ms | blobs %d"
+                  % (self.n / elapsed, 1000 * self.proc / self.n, 1000 * self.cpu / self.n,
+                     100 * self.cpu / elapsed, 1000 * self.age / self.n, self.nblobs))
+            self.reset_stats()
+
+marker_cache = [None, None, None, None]   # markers, views, scale -> cairo path
+
+def draw_markers(overlay_elem, ctx, timestamp, duration):
+    # Streaming thread, every displayed frame: the marker path is only
+    # rebuilt when the detector or apply_zoom replaced its list (a new
+    # marker generation); otherwise the cached path is replayed.
+    marks, views, scale = detector.markers, ir_views, out_scale
+    if not marks or not views:
+        return
+    c = marker_cache
+    if c[0] is not marks or c[1] is not views or c[2] != scale:
+        for x, y, r in marks:
+            for (cl, ct, cw, ch), (px, py, pw, ph) in views:
+                if not (cl <= x < cl + cw and ct <= y < ct + ch):
+                    continue
+                mx = px + (x - cl) * pw / cw
+                my = py + (y - ct) * ph / ch
+                mr = max(6.0, r * pw / cw)
+                ctx.rectangle(scale * (mx - mr), scale * (my - mr), scale * 2 * mr, scale * 2 * mr)
+        c[:] = [marks, views, scale, ctx.copy_path()]
+    else:
+        ctx.append_path(c[3])
+    ctx.set_source_rgb(1.0, 0.3, 0.0)
+    ctx.set_line_width(2.0 * scale)
+    ctx.stroke()
+
+markers_elem = pipeline.get_by_name("markers")
+markers_linked = False
+
+def set_markers_linked(on):
+    # postconv ! [markers !] overlay: the cairooverlay and its Python draw
+    # callback stay out of the display path while the detector is off
+    global markers_linked
+    if markers_elem is None or on == markers_linked:
+        return
+    markers_linked = on
+    postconv = pipeline.get_by_name("postconv")
+    def _relink(pad, info):
+        if on:
+            postconv.unlink(overlay)
+            postconv.link(markers_elem)
+            markers_elem.link(overlay)
+        else:
+            postconv.unlink(markers_elem)
+            markers_elem.unlink(overlay)
+            postconv.link(overlay)
+        return Gst.PadProbeReturn.REMOVE
+    postconv.get_static_pad("src").add_probe(Gst.PadProbeType.IDLE, _relink)
+
+detector = None
+if HAVE_DETECT:
+    detector = HotSpotDetector(pipeline.get_by_name("irdetect"))
+    if markers_elem is not None:
+        markers_elem.connect("draw", draw_markers)
+        set_markers_linked(detector.enabled)
+elif DETECT_ENABLE:
+    print("Note: IR detector disabled (needs numpy and appsink).")
+
+# ---------- Bus watch / QoS quality ladder ----------
+class QualityLadder:
+    """Steps display quality down under sustained lateness or drops and back
+    up after sustained headroom. Stats are gathered per QOS_INTERVAL window."""
+    RUNGS = ["full quality", "lower output resolution", "lower PIP frame rate", "analysis off"]
+
+    def __init__(self):
+        self.level = 0
+        self.bad = 0
+        self.good = 0
+        self.saved_pip_fps = None
+        self.saved_detect = None
+        self.qos_dropped = {}   # element name -> last cumulative QoS drop count
+        self.latency = None     # pipeline latency (ns), re-read on LATENCY messages
+        self.started = time()
+        self.reset_window()
+
+    def reset_window(self):
+        self.frames = 0
+        self.age_sum = 0.0
+        self.age_max = 0.0
+        self.drops = 0
+        self.jitter = 0.0
+
+    def sink_probe(self, pad, info):
+        # Age of each frame reaching the sink against its capture timestamp,
+        # minus the latency the pipeline is configured to add (capture frame,
+        # compositor wait in paced mode), so only unplanned delay counts
+        pts = info.get_buffer().pts
+        clock = pipeline.get_clock()
+        if clock is not None and pts != Gst.CLOCK_TIME_NONE:
+            age = (clock.get_time() - pipeline.get_base_time() - pts
+                   - (self.latency or 0)) / 1e6
+            self.frames += 1
+            self.age_sum += age
+            self.age_max = max(self.age_max, age)
+        return Gst.PadProbeReturn.OK
+
+    def refresh_latency(self):
+        # Main loop only; outsink may be a bin, which has no get_latency()
+        query = Gst.Query.new_latency()
+        if pipeline.query(query):
+            live, lmin, lmax = query.parse_latency()
+            self.latency = lmin
+
+    def on_overrun(self, q):
+        # q_present had to throw a compositor frame away
+        self.drops += 1
+
+    def on_qos(self, msg):
+        # Only drops after the compositor count, so drops and the frames
+        # counted at the sink are both compositor output frames
+        if not in_display_path(msg.src):
+            return
+        _, processed, dropped = msg.parse_qos_stats()
+        name = msg.src.get_name()
+        prev = self.qos_dropped.get(name)
+        self.qos_dropped[name] = dropped
+        if prev is not None and dropped > prev:
+            self.drops += dropped - prev
+        jitter, proportion, quality = msg.parse_qos_values()
+        self.jitter = max(self.jitter, jitter / 1e6)
+
+    def tick(self):
+        if self.latency is None:
+            self.refresh_latency()
+        frames, drops, jitter = self.frames, self.drops, self.jitter
+        age = self.age_sum / frames if frames else 0.0
+        age_max = self.age_max
+        self.reset_window()
+        if frames + drops == 0 or time() - self.started < QOS_WARMUP:
+            return True
+        ratio = float(drops) / (frames + drops)
+        bad = age > QOS_LATE_MS or jitter > QOS_LATE_MS or ratio > QOS_DROP_HIGH
+        good = age < QOS_LATE_MS / 2 and jitter < QOS_LATE_MS / 2 and ratio < QOS_DROP_LOW
+        self.bad = self.bad + 1 if bad else 0
+        self.good = self.good + 1 if good else 0
+        trigger = ("age %.0f ms (max %.0f), drops %.1f%%, qos jitter %.0f ms over %d window(s)"
+                   % (age, age_max, 100 * ratio, jitter, max(self.bad, self.good)))
+        if self.bad >= QOS_DOWN_WINDOWS and self.level < len(self.RUNGS) - 1:
+            self.step(self.level + 1, trigger)
+        elif self.good >= QOS_UP_WINDOWS and self.level > 0:
+            self.step(self.level - 1, trigger)
+        return True
+
+    def step(self, level, trigger):
+        print("[qos] %d (%s) -> %d (%s): %s"
+              % (self.level, self.RUNGS[self.level], level, self.RUNGS[level], trigger))
+        self.level = level
+        self.bad = 0
+        self.good = 0
+        set_out_scale(QOS_LOW_SCALE if level >= 1 else 1.0)
+        if level >= 2 and self.saved_pip_fps is None:
+            self.saved_pip_fps = LAYOUT_FPS[MODE_PIP_EO]["q_ir_small"]
+            set_pip_fps(QOS_PIP_FPS)
+        elif level < 2 and self.saved_pip_fps is not None:
+            # leave a budget picked with 'f' meanwhile alone
+            if LAYOUT_FPS[MODE_PIP_EO]["q_ir_small"] == QOS_PIP_FPS:
+                set_pip_fps(self.saved_pip_fps)
+            self.saved_pip_fps = None
+        if detector:
+            if level >= 3 and self.saved_detect is None:
+                self.saved_detect = detector.enabled
+                detector.set_enabled(False)
+            elif level < 3 and self.saved_detect is not None:
+                detector.set_enabled(self.saved_detect)
+                self.saved_detect = None
+
+# Elements after the compositor; outsink's children are matched by ancestry
+DISPLAY_PATH = ("compcaps", "sysconv", "postconv", "markers", "overlay",
+                "q_present", "presented", "outsink")
+
+def in_display_path(obj):
+    return obj.get_name() in DISPLAY_PATH or obj.has_as_ancestor(outsink)
+
+ladder = QualityLadder()
+pipeline_failed = Event()
+
+def on_bus_message(bus, msg):
+    t = msg.type
+    if t == Gst.MessageType.QOS:
+        ladder.on_qos(msg)
+    elif t == Gst.MessageType.LATENCY:
+        pipeline.recalculate_latency()
+        ladder.refresh_latency()
+    elif t == Gst.MessageType.WARNING:
+        err, dbg = msg.parse_warning()
+        print("Warning from %s: %s" % (msg.src.get_name(), err.message))
+    elif t == Gst.MessageType.ERROR:
+        err, dbg = msg.parse_error()
+        print("Error from %s: %s (%s)" % (msg.src.get_name(), err.message, dbg))
+        pipeline_failed.set()
+    return True
+
+bus = pipeline.get_bus()
+bus.add_signal_watch()
+bus.connect("message", on_bus_message)
+outsink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, ladder.sink_probe)
+queues["q_present"].connect("overrun", ladder.on_overrun)
+if not BENCH:
+    # measurements must not be skewed by the ladder moving underneath them
+    GLib.timeout_add_seconds(QOS_INTERVAL, ladder.tick)
+
+# ---------- Presentation pacing ----------
+class FrameIntervals:
+    """Histogram of intervals between presented frames (judder meter)."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.counts = [0] * (len(FRAME_HIST_EDGES_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def probe(self, pad, info):
+        # On the src pad of "presented": in paced mode that identity has
+        # already done the clock wait, so this is when the sink renders
+        clock = pipeline.get_clock()
+        if clock is None:
+            return Gst.PadProbeReturn.OK
+        shown = clock.get_time()
+        if self.last is not None:
+            ms = (shown - self.last) / 1e6
+            i = 0
+            while i < len(FRAME_HIST_EDGES_MS) and ms >= FRAME_HIST_EDGES_MS[i]:
+                i += 1
+            self.counts[i] += 1
+            self.n += 1
+            self.total += ms
+            self.total_sq += ms * ms
+        self.last = shown
+        return Gst.PadProbeReturn.OK
+
+    def report(self, label):
+        if self.n == 0:
+            return
+        mean = self.total / self.n
+        sd = max(0.0, self.total_sq / self.n - mean * mean) ** 0.5
+        edges = ("0",) + tuple(str(e) for e in FRAME_HIST_EDGES_MS)
+        bins = ["%s-%s:%d" % (edges[i], edges[i + 1], c) for i, c in enumerate(self.counts[:-1])]
+        bins.append("%s+:%d" % (edges[-1], self.counts[-1]))
+        print("[pace] %s: %.1f fps | interval %.1f +- %.1f ms | %s"
+              % (label, 1000.0 / mean if mean else 0.0, mean, sd, " ".join(bins)))
+
+def set_present_mode(mode):
+    # "paced": compositor ticks at OUTPUT_FPS (waiting up to
+    # PACED_COMP_LATENCY_MS for the later camera), "presented" waits for each
+    # frame's clock time and q_present keeps at most one frame in hand. The
+    # sink syncs too (a no-op wait by then) so it still posts QoS.
+    global present_mode
+    present_mode = mode
+    paced = mode == "paced"
+    try:
+        comp.set_property("latency", PACED_COMP_LATENCY_MS * Gst.MSECOND if paced else 0)
+    except Exception:
+        pass
+    presented.set_property("sync", paced)
+    try:
+        outsink.set_property("sync", paced)
+    except Exception:
+        pass
+    update_compcaps()
+    intervals.reset()
+    pipeline.recalculate_latency()
+
+def toggle_present_mode():
+    intervals.report(present_mode)
+    set_present_mode("latency" if present_mode == "paced" else "paced")
+    print("Presentation: %s" % present_mode)
+
+def pace_tick():
+    intervals.report(present_mode)
+    intervals.reset()
+    return True
+
+intervals = FrameIntervals()
+presented = pipeline.get_by_name("presented")
+presented.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, intervals.probe)
+set_present_mode(PRESENT_MODE)
+if PACE_REPORT_INTERVAL > 0 and not BENCH:
+    GLib.timeout_add_seconds(PACE_REPORT_INTERVAL, pace_tick)
+
+# ---------- Benchmark (--bench) ----------
+MODE_NAMES = ["WIDE", "EO ZOOM", "IR ONLY", "SPLIT", "PIP (EO BIG)", "PIP (IR BIG)"]
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+def on_main(fn):
+    # Run fn on the GLib main loop and wait for it
+    done = Event()
+    def _do():
+        fn()
+        done.set()
+        return False
+    GLib.idle_add(_do)
+    done.wait()
+
+def measure_cpu(label, on_start=None):
+    sleep(BENCH_SETTLE)
+    if on_start:
+        on_start()
+    c0 = cpu_seconds()
+    t0 = time()
+    sleep(BENCH_SECONDS)
+    pct = 100.0 * (cpu_seconds() - c0) / (time() - t0)
+    print("[bench] %-40s cpu %6.1f%%" % (label, pct))
+    return pct
+
+def bench_fps_budgets():
+    global fps_budgets_on
+    for mode in (MODE_PIP_EO, MODE_PIP_IR):
+        results = {}
+        for on in (False, True):
+            def _setup():
+                global fps_budgets_on
+                fps_budgets_on = on
+                set_mode(mode)
+            on_main(_setup)
+            results[on] = measure_cpu("%s, budgets %s" % (MODE_NAMES[mode], "on" if on else "off"))
+        print("[bench] %-40s saved %5.1f%% cpu" % (MODE_NAMES[mode], results[False] - results[True]))
+    fps_budgets_on = True
+
+def bench_crop_meta():
+    # CPU fallback only: zoomed layouts with videocrop copying every crop vs
+    # zero-copy (CropView views for the full panes, crop meta where it can)
+    global eo_zoom
+    if HAVE_NVVIDCONV:
+        return
+    eo_zoom = 4.0
+    for mode in (MODE_EO_ZOOM, MODE_SPLIT, MODE_PIP_EO):
+        results = {}
+        for on in (False, True):
+            def _setup():
+                set_crop_meta(on)
+                set_mode(mode)
+            on_main(_setup)
+            results[on] = measure_cpu("%s 3x, crop %s" % (MODE_NAMES[mode], "zero-copy" if on else "videocrop"))
+        print("[bench] %-40s saved %5.1f%% cpu (%s)"
+              % (MODE_NAMES[mode], results[False] - results[True],
+                 ", ".join("%s=%s" % kv for kv in sorted(crop_paths.items()))))
+    on_main(lambda: set_crop_meta(CPU_CROP_META))
+
+def bench_present():
+    # Two cameras side by side show judder the most
+    for mode in ("latency", "paced"):
+        def _setup():
+            set_present_mode(mode)
+            set_mode(MODE_SPLIT)
+        on_main(_setup)
+        measure_cpu("%s, present %s" % (MODE_NAMES[MODE_SPLIT], mode), intervals.reset)
+        intervals.report(mode)
+    on_main(lambda: set_present_mode(PRESENT_MODE))
+
+def run_bench():
+    print("[bench] %ds per case after %ds settle, cpu = %% of one core" % (BENCH_SECONDS, BENCH_SETTLE))
+    bench_fps_budgets()
+    bench_crop_meta()
+    bench_present()
+
+# Keyboard handling (SPACE / UP/i / DOWN/k / h / f / p)
 class KB:
     def __init__(self):
         self.fd = sys.stdin.fileno()
@@ -361,6 +1765,9 @@ class KB:
         if ch1 == " ": return b"SPACE"
         if ch1 in ("i","I"): return b"UP"
         if ch1 in ("k","K"): return b"DOWN"
+        if ch1 in ("h","H"): return b"DETECT"
+        if ch1 in ("f","F"): return b"PIPFPS"
+        if ch1 in ("p","P"): return b"PACE"
         if ch1 == "\x1b":
             r,_,_ = select.select([sys.stdin], [], [], 0.002)
             if not r: return None
@@ -381,48 +1788,79 @@ main_loop_thread.start()
 pipeline.set_state(Gst.State.PLAYING)
 eo_zoom = 2.0
 set_mode(MODE_WIDE)
+if detector:
+    detector.start()
 
 if not sys.stdin.isatty():
     print("Note: stdin not a TTY. Use i/k for zoom, SPACE to switch modes.")
-print("Controls: SPACE=next | UP/i=zoom in | DOWN/k=zoom out | Ctrl+C quits")
+print("Controls: SPACE=next | UP/i=zoom in | DOWN/k=zoom out | h=hot-spots | f=PIP fps | p=pacing | Ctrl+C quits")
 
 last_zoom_time = time()
 kb = KB()
 
 try:
-    while True:
-        now = time()
-        key = kb.read_key()
-
-        if key == b"UP":
-            if current_mode != MODE_WIDE and (now - last_zoom_time) >= ZOOM_COOLDOWN:
-                step = eo_step_up(eo_zoom)
-                eo_zoom = clamp_eo(round(eo_zoom + step, 2))
-                schedule_apply()
-                last_zoom_time = now
-
-        elif key == b"DOWN":
-            if current_mode != MODE_WIDE and (now - last_zoom_time) >= ZOOM_COOLDOWN:
-                eo_zoom = eo_step_down_clean(eo_zoom)
-                eo_zoom = clamp_eo(eo_zoom)
-                schedule_apply()
-                last_zoom_time = now
-
-        elif key == b"SPACE":
-            next_mode = (current_mode + 1) % NUM_MODES
-            def _sw():
-                set_mode(next_mode)
-                return False
-            GLib.idle_add(_sw)
-
-        sleep(0.03)
+    if BENCH:
+        run_bench()
+    else:
+        while not pipeline_failed.is_set():
+            now = time()
+            key = kb.read_key()
+
+            if key == b"UP":
+                if current_mode != MODE_WIDE and (now - last_zoom_time) >= ZOOM_COOLDOWN:
+                    step = eo_step_up(eo_zoom)
+                    eo_zoom = clamp_eo(round(eo_zoom + step, 2))
+                    schedule_apply()
+                    last_zoom_time = now
+
+            elif key == b"DOWN":
+                if current_mode != MODE_WIDE and (now - last_zoom_time) >= ZOOM_COOLDOWN:
+                    eo_zoom = eo_step_down_clean(eo_zoom)
+                    eo_zoom = clamp_eo(eo_zoom)
+                    schedule_apply()
+                    last_zoom_time = now
+
+            elif key == b"SPACE":
+                next_mode = (current_mode + 1) % NUM_MODES
+                def _sw():
+                    set_mode(next_mode)
+                    return False
+                GLib.idle_add(_sw)
+
+            elif key == b"DETECT":
+                if detector:
+                    def _det():
+                        detector.set_enabled(not detector.enabled)
+                        return False
+                    GLib.idle_add(_det)
+
+            elif key == b"PIPFPS":
+                def _fps():
+                    cycle_pip_fps()
+                    return False
+                GLib.idle_add(_fps)
+
+            elif key == b"PACE":
+                def _pace():
+                    toggle_present_mode()
+                    return False
+                GLib.idle_add(_pace)
+
+            sleep(0.03)
 
 except KeyboardInterrupt:
     pass
 finally:
     kb.restore()
 
+if detector:
+    detector.stop()
+if not BENCH:
+    intervals.report(present_mode)
 pipeline.set_state(Gst.State.NULL)
+for dec in decoders:
+    dec.stop()
+bus.remove_signal_watch()
 main_loop.quit()
 main_loop_thread.join()
 print("Stopped.")